@@ -0,0 +1,188 @@
+"""
+Shared asyncio HTTP client helpers for the Python test scripts
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import sys
+import time
+
+BODY_PREVIEW = 200
+
+def positive_int(value):
+    """argparse type: an integer of at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+def non_negative_int(value):
+    """argparse type: an integer of at least 0"""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be at least 0, got {number}")
+    return number
+
+def wait_ready(host, port, timeout=2.0):
+    """Poll until the server accepts connections; True if it did in time"""
+    # Exponential backoff from 1 ms, so a server that is already up costs
+    # one connect and one that is still starting is picked up quickly
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        try:
+            # Bound each attempt by the time left, not the whole budget
+            remaining = max(0.0, deadline - time.monotonic())
+            socket.create_connection((host, port), timeout=remaining).close()
+            return True
+        except OSError:
+            if time.monotonic() + delay > deadline:
+                return False
+            time.sleep(delay)
+            delay *= 2
+
+def parse_content_length(head):
+    """Return the Content-Length of a response head, or None if absent"""
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            return int(value.strip())
+    return None
+
+def parse_status(response):
+    """Return the status code of a response, or None if it has none"""
+    parts = response[:response.find(b'\r\n')].split(b' ', 2)
+    if len(parts) >= 2 and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
+def make_result(name, elapsed, response, error=None):
+    """One entry of the structured test report"""
+    result = {
+        'name': name,
+        'latency_ms': round(elapsed * 1000, 3),
+        'status': parse_status(response),
+        'bytes': len(response),
+    }
+    if error is not None:
+        result['error'] = str(error)
+    return result
+
+def write_report(report):
+    """Write the structured report as JSON on stdout"""
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+def format_response(response):
+    """Render a response for display without decoding the whole body"""
+    eoh = response.find(b'\r\n\r\n')
+    if eoh == -1:
+        return response[:BODY_PREVIEW].decode('ascii', errors='replace')
+    
+    # Only the head and a short preview of the body go through a decoder;
+    # the rest is just counted
+    head = response[:eoh].decode('ascii', errors='replace')
+    body = memoryview(response)[eoh + 4:]
+    preview = bytes(body[:BODY_PREVIEW]).decode('utf-8', errors='replace')
+    return f"{head}\n\n{preview}\n<body: {len(body)} bytes>"
+
+async def read_response(reader, timeout=5.0):
+    """Read one response, returning (head, body)"""
+    # The server keeps connections open, so read the head and then exactly
+    # Content-Length bytes instead of waiting for EOF
+    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=timeout)
+    length = parse_content_length(head)
+    if length is not None:
+        body = await asyncio.wait_for(reader.readexactly(length), timeout=timeout)
+        return head, body
+    
+    # No length announced: fall back to reading until close/timeout
+    chunks = []
+    while True:
+        try:
+            chunk = await asyncio.wait_for(reader.read(65536), timeout=timeout)
+        except asyncio.TimeoutError:
+            break
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return head, b''.join(chunks)
+
+async def open_bounded(host, port, timeout=5.0):
+    """open_connection() that gives up after `timeout` seconds"""
+    # Without a bound a stalled connect waits out the OS TCP timeout
+    return await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+
+async def exchange(reader, writer, request_data, timeout=5.0):
+    """Send a request on an open connection, returning (head, body, elapsed)
+    
+    `elapsed` runs from the write to the end of the response: connecting
+    and closing are left out, so every caller reports the same span.
+    """
+    start = time.perf_counter()
+    writer.write(request_data)
+    # A peer that stops reading would otherwise stall drain() indefinitely
+    await asyncio.wait_for(writer.drain(), timeout=timeout)
+    head, body = await read_response(reader, timeout)
+    return head, body, time.perf_counter() - start
+
+async def timed_fetch(host, port, request_data, timeout=5.0):
+    """Like fetch(), but return (response, elapsed) as timed by exchange()"""
+    # No write_eof() here: the server drops a queued response once it sees
+    # the client's EOF, so the connection is closed only after reading
+    reader, writer = await open_bounded(host, port, timeout)
+    try:
+        head, body, elapsed = await exchange(reader, writer, request_data, timeout)
+    except BaseException:
+        # Drop unsent bytes, or close() would wait on the stalled peer
+        writer.transport.abort()
+        raise
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return head + body, elapsed
+
+async def fetch(host, port, request_data, timeout=5.0):
+    """Send one request over a one-shot connection and return the response"""
+    response, _ = await timed_fetch(host, port, request_data, timeout)
+    return response
+
+async def run_many(host, port, requests, concurrency=100, timeout=5.0):
+    """Fetch every request, at most `concurrency` at a time
+    
+    Returns the responses in request order; a failed request yields its
+    exception instead of a response.
+    """
+    # Semaphore(0) would never let a request through
+    if concurrency < 1:
+        raise ValueError(f"concurrency must be at least 1, got {concurrency}")
+    sem = asyncio.Semaphore(concurrency)
+    
+    async def bounded(request_data):
+        async with sem:
+            return await fetch(host, port, request_data, timeout)
+    
+    return await asyncio.gather(*[bounded(r) for r in requests],
+                                return_exceptions=True)
+
+def count_failed(responses):
+    """Number of run_many() results that are exceptions, not responses"""
+    return sum(1 for r in responses if isinstance(r, BaseException))
+
+def load_stats(count, failed, elapsed):
+    """Load run figures for the structured report"""
+    return {
+        'requests': count,
+        'failed': failed,
+        'elapsed_ms': round(elapsed * 1000, 3),
+        'requests_per_s': round(count / elapsed, 1) if elapsed > 0 else None,
+    }
+
+def summarize_load(stats):
+    """Describe load_stats() for humans: count, failures and throughput"""
+    rate = stats['requests_per_s']
+    rate = f"{rate:.0f}" if rate is not None else "inf"
+    return (f"{stats['requests']} requests, {stats['failed']} failed, "
+            f"{stats['elapsed_ms'] / 1000:.3f}s ({rate} req/s)")
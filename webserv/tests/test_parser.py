@@ -3,211 +3,380 @@
 Test script for HTTP request parser using raw sockets and telnet-style communication
 """
 
-import socket
+import argparse
+import asyncio
+import os
+import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
+
+from common_client import (count_failed, exchange, format_response, load_stats,
+                           make_result, non_negative_int, open_bounded,
+                           parse_content_length, positive_int, run_many,
+                           summarize_load, timed_fetch, wait_ready, write_report)
 
 HOST = 'localhost'
 PORT = 8080
+VERBOSE = False
+
+# One make_result() entry per test sent, across every --repeat run
+RESULTS = []
+
+def build_requests(host, port):
+    """Build the REQ_* bytes constants for the target server
+    
+    Called once after the options are parsed, so every Host header names
+    the --host/--port actually connected to and repeated runs only pay
+    for the I/O.
+    """
+    global REQ_GET, REQ_GET_QUERY, REQ_POST_FORM, REQ_POST_JSON, REQ_DELETE
+    global REQ_INVALID_METHOD, REQ_MALFORMED, REQ_DIRECTORY, REQ_NOT_FOUND
+    global REQ_LARGE_HEADERS, LOAD_REQUESTS
+    authority = b"%s:%d" % (host.encode('ascii'), port)
+    
+    REQ_GET = (
+        b"GET /test.html HTTP/1.1\r\n"
+        b"Host: %s\r\n"
+        b"User-Agent: PythonTestClient/1.0\r\n"
+        b"Accept: text/html\r\n"
+        b"Connection: keep-alive\r\n"
+        b"\r\n"
+    ) % authority
+    
+    REQ_GET_QUERY = (
+        b"GET /api/search?q=test&limit=10 HTTP/1.1\r\n"
+        b"Host: %s\r\n"
+        b"Connection: keep-alive\r\n"
+        b"\r\n"
+    ) % authority
+    
+    BODY_FORM = b"name=John&email=john@example.com&message=Hello"
+    REQ_POST_FORM = (
+        b"POST /api/submit HTTP/1.1\r\n"
+        b"Host: %s\r\n"
+        b"Content-Type: application/x-www-form-urlencoded\r\n"
+        b"Content-Length: %d\r\n"
+        b"Connection: keep-alive\r\n"
+        b"\r\n"
+        b"%s"
+    ) % (authority, len(BODY_FORM), BODY_FORM)
+    
+    BODY_JSON = b'{"name": "Test", "value": 123, "active": true}'
+    REQ_POST_JSON = (
+        b"POST /api/data HTTP/1.1\r\n"
+        b"Host: %s\r\n"
+        b"Content-Type: application/json\r\n"
+        b"Content-Length: %d\r\n"
+        b"Connection: keep-alive\r\n"
+        b"\r\n"
+        b"%s"
+    ) % (authority, len(BODY_JSON), BODY_JSON)
+    
+    REQ_DELETE = (
+        b"DELETE /api/items/123 HTTP/1.1\r\n"
+        b"Host: %s\r\n"
+        b"Authorization: Bearer token123\r\n"
+        b"Connection: keep-alive\r\n"
+        b"\r\n"
+    ) % authority
+    
+    REQ_INVALID_METHOD = (
+        b"INVALID /test HTTP/1.1\r\n"
+        b"Host: %s\r\n"
+        b"Connection: close\r\n"
+        b"\r\n"
+    ) % authority
+    
+    REQ_MALFORMED = (
+        b"GET /test\r\n"  # Missing HTTP version
+        b"Host: %s\r\n"
+        b"\r\n"
+    ) % authority
+    
+    REQ_DIRECTORY = (
+        b"GET / HTTP/1.1\r\n"
+        b"Host: %s\r\n"
+        b"Connection: keep-alive\r\n"
+        b"\r\n"
+    ) % authority
+    
+    REQ_NOT_FOUND = (
+        b"GET /nonexistent/file.html HTTP/1.1\r\n"
+        b"Host: %s\r\n"
+        b"Connection: keep-alive\r\n"
+        b"\r\n"
+    ) % authority
+    
+    REQ_LARGE_HEADERS = (
+        b"GET /test.html HTTP/1.1\r\n"
+        b"Host: %s\r\n"
+        b"User-Agent: TestClient/1.0\r\n"
+        b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+        b"Accept-Language: en-US,en;q=0.5\r\n"
+        b"Accept-Encoding: gzip, deflate\r\n"
+        b"DNT: 1\r\n"
+        b"Connection: keep-alive\r\n"
+        b"Upgrade-Insecure-Requests: 1\r\n"
+        b"Cache-Control: max-age=0\r\n"
+        b"\r\n"
+    ) % authority
+    
+    # Well-formed requests cycled through by --load
+    LOAD_REQUESTS = [
+        REQ_GET, REQ_GET_QUERY, REQ_POST_FORM, REQ_POST_JSON,
+        REQ_DELETE, REQ_DIRECTORY, REQ_NOT_FOUND, REQ_LARGE_HEADERS,
+    ]
 
-def send_request(request_data, description):
-    """Send a raw HTTP request and receive response"""
+class Session:
+    """A persistent keep-alive connection shared by several tests"""
+    
+    def __init__(self, host, port, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        # The server drops pipelined bytes, so requests go one at a time
+        self._lock = asyncio.Lock()
+    
+    async def send(self, request_data):
+        """Send a request on the shared connection
+        
+        Returns (response, elapsed), timed by exchange() once the lock is
+        held, so time spent queued behind other tests is not counted.
+        """
+        async with self._lock:
+            if self._writer is None:
+                self._reader, self._writer = await open_bounded(self.host, self.port, self.timeout)
+            
+            try:
+                head, body, elapsed = await exchange(self._reader, self._writer, request_data,
+                                                     self.timeout)
+            except Exception:
+                # Drop unsent bytes, or close() would wait on the stalled peer
+                self._writer.transport.abort()
+                await self.close()
+                raise
+            
+            # Without a length the stream position is unknown: start afresh
+            if parse_content_length(head) is None:
+                await self.close()
+            return head + body, elapsed
+    
+    async def close(self):
+        """Close the shared connection, if open"""
+        if self._writer is not None:
+            writer = self._writer
+            self._reader = None
+            self._writer = None
+            writer.close()
+            await writer.wait_closed()
+
+async def send_request(request_data, description, session=None):
+    """Send a raw HTTP request and return its make_result() entry
+    
+    Requests go over the keep-alive session when one is given, otherwise
+    over a one-shot connection of their own. Either way latency_ms covers
+    only the write to the end of the response; a failed request reports
+    the time until it failed instead.
+    """
+    response = b''
+    start = time.perf_counter()
+    try:
+        if session is not None:
+            response, elapsed = await session.send(request_data)
+        else:
+            response, elapsed = await timed_fetch(HOST, PORT, request_data)
+        error = None
+        
+    except Exception as e:
+        error = e
+        elapsed = time.perf_counter() - start
+    
+    result = make_result(description, elapsed, response, error)
+    if not VERBOSE:
+        return result
+    
+    # Print the whole report at once so concurrent tests do not interleave
     print(f"\n{'='*60}")
     print(f"Test: {description}")
     print(f"{'='*60}")
     print("Sending request:")
-    print(request_data)
+    print(request_data.decode('utf-8', errors='replace'))
     print("-" * 60)
     
-    try:
-        # Create socket connection
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(5.0)
-        sock.connect((HOST, PORT))
-        
-        # Send request
-        sock.sendall(request_data.encode('utf-8'))
-        
-        # Receive response
-        response = b''
-        while True:
-            try:
-                chunk = sock.recv(4096)
-                if not chunk:
-                    break
-                response += chunk
-            except socket.timeout:
-                break
-        
-        sock.close()
-        
-        print("Received response:")
-        print(response.decode('utf-8', errors='replace'))
-        return True
-        
-    except Exception as e:
-        print(f"Error: {e}")
-        return False
+    if error is not None:
+        print(f"Error: {error}")
+        return result
+    
+    print("Received response:")
+    print(format_response(response))
+    return result
 
-def test_get_request():
+async def test_get_request(session):
     """Test basic GET request"""
-    request = (
-        "GET /test.html HTTP/1.1\r\n"
-        "Host: localhost:8080\r\n"
-        "User-Agent: PythonTestClient/1.0\r\n"
-        "Accept: text/html\r\n"
-        "Connection: close\r\n"
-        "\r\n"
-    )
-    send_request(request, "GET Request - Static File")
-
-def test_get_with_query():
+    return await send_request(REQ_GET, "GET Request - Static File", session)
+
+async def test_get_with_query(session):
     """Test GET request with query string"""
-    request = (
-        "GET /api/search?q=test&limit=10 HTTP/1.1\r\n"
-        "Host: localhost:8080\r\n"
-        "Connection: close\r\n"
-        "\r\n"
-    )
-    send_request(request, "GET Request - With Query String")
-
-def test_post_request():
+    return await send_request(REQ_GET_QUERY, "GET Request - With Query String", session)
+
+async def test_post_request(session):
     """Test POST request with body"""
-    body = "name=John&email=john@example.com&message=Hello"
-    request = (
-        f"POST /api/submit HTTP/1.1\r\n"
-        f"Host: localhost:8080\r\n"
-        f"Content-Type: application/x-www-form-urlencoded\r\n"
-        f"Content-Length: {len(body)}\r\n"
-        f"Connection: close\r\n"
-        f"\r\n"
-        f"{body}"
-    )
-    send_request(request, "POST Request - Form Data")
-
-def test_post_json():
+    return await send_request(REQ_POST_FORM, "POST Request - Form Data", session)
+
+async def test_post_json(session):
     """Test POST request with JSON body"""
-    body = '{"name": "Test", "value": 123, "active": true}'
-    request = (
-        f"POST /api/data HTTP/1.1\r\n"
-        f"Host: localhost:8080\r\n"
-        f"Content-Type: application/json\r\n"
-        f"Content-Length: {len(body)}\r\n"
-        f"Connection: close\r\n"
-        f"\r\n"
-        f"{body}"
-    )
-    send_request(request, "POST Request - JSON Data")
-
-def test_delete_request():
+    return await send_request(REQ_POST_JSON, "POST Request - JSON Data", session)
+
+async def test_delete_request(session):
     """Test DELETE request"""
-    request = (
-        "DELETE /api/items/123 HTTP/1.1\r\n"
-        "Host: localhost:8080\r\n"
-        "Authorization: Bearer token123\r\n"
-        "Connection: close\r\n"
-        "\r\n"
-    )
-    send_request(request, "DELETE Request")
-
-def test_invalid_method():
+    return await send_request(REQ_DELETE, "DELETE Request", session)
+
+async def test_invalid_method():
     """Test invalid HTTP method"""
-    request = (
-        "INVALID /test HTTP/1.1\r\n"
-        "Host: localhost:8080\r\n"
-        "Connection: close\r\n"
-        "\r\n"
-    )
-    send_request(request, "Invalid HTTP Method (should return 405)")
-
-def test_malformed_request():
+    return await send_request(REQ_INVALID_METHOD, "Invalid HTTP Method (should return 405)")
+
+async def test_malformed_request():
     """Test malformed request"""
-    request = (
-        "GET /test\r\n"  # Missing HTTP version
-        "Host: localhost:8080\r\n"
-        "\r\n"
-    )
-    send_request(request, "Malformed Request (should return 400)")
-
-def test_directory_listing():
+    return await send_request(REQ_MALFORMED, "Malformed Request (should return 400)")
+
+async def test_directory_listing(session):
     """Test directory listing"""
-    request = (
-        "GET / HTTP/1.1\r\n"
-        "Host: localhost:8080\r\n"
-        "Connection: close\r\n"
-        "\r\n"
-    )
-    send_request(request, "Directory Listing (root)")
-
-def test_404_not_found():
+    return await send_request(REQ_DIRECTORY, "Directory Listing (root)", session)
+
+async def test_404_not_found(session):
     """Test 404 error"""
-    request = (
-        "GET /nonexistent/file.html HTTP/1.1\r\n"
-        "Host: localhost:8080\r\n"
-        "Connection: close\r\n"
-        "\r\n"
-    )
-    send_request(request, "404 Not Found")
-
-def test_large_headers():
+    return await send_request(REQ_NOT_FOUND, "404 Not Found", session)
+
+async def test_large_headers(session):
     """Test request with many headers"""
-    request = (
-        "GET /test.html HTTP/1.1\r\n"
-        "Host: localhost:8080\r\n"
-        "User-Agent: TestClient/1.0\r\n"
-        "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
-        "Accept-Language: en-US,en;q=0.5\r\n"
-        "Accept-Encoding: gzip, deflate\r\n"
-        "DNT: 1\r\n"
-        "Connection: close\r\n"
-        "Upgrade-Insecure-Requests: 1\r\n"
-        "Cache-Control: max-age=0\r\n"
-        "\r\n"
-    )
-    send_request(request, "Request with Multiple Headers")
+    return await send_request(REQ_LARGE_HEADERS, "Request with Multiple Headers", session)
 
-def main():
-    print("="*60)
-    print("HTTP Request Parser Test Suite")
-    print("="*60)
-    print(f"Target: {HOST}:{PORT}")
-    print("Make sure your webserver is running before executing tests!")
-    print()
-    
-    input("Press Enter to start tests...")
-    
-    # Run all tests
-    test_get_request()
-    time.sleep(0.5)
-    
-    test_get_with_query()
-    time.sleep(0.5)
-    
-    test_post_request()
-    time.sleep(0.5)
-    
-    test_post_json()
-    time.sleep(0.5)
+async def run_tests():
+    """Run every test concurrently"""
+    # Well-formed requests share one keep-alive connection; the negative
+    # tests get one-shot connections so they cannot poison the session
+    session = Session(HOST, PORT)
+    try:
+        # gather() returns results in argument order, so reports from
+        # different runs line up test by test
+        results = await asyncio.gather(
+            test_get_request(session),
+            test_get_with_query(session),
+            test_post_request(session),
+            test_post_json(session),
+            test_delete_request(session),
+            test_directory_listing(session),
+            test_404_not_found(session),
+            test_large_headers(session),
+            test_invalid_method(),
+            test_malformed_request(),
+        )
+        RESULTS.extend(results)
+    finally:
+        await session.close()
+
+def load_worker(count, concurrency, host, port):
+    """Worker process: fire `count` well-formed requests on its own loop
     
-    test_delete_request()
-    time.sleep(0.5)
+    Returns (failed, elapsed), timed inside the worker so process startup
+    and teardown are not counted.
+    """
+    # Built here too: a spawned worker does not inherit main()'s requests
+    build_requests(host, port)
+    requests = [LOAD_REQUESTS[i % len(LOAD_REQUESTS)] for i in range(count)]
+    start = time.perf_counter()
+    responses = asyncio.run(run_many(host, port, requests, concurrency))
+    return count_failed(responses), time.perf_counter() - start
+
+def run_load(count, concurrency, workers):
+    """Split `count` requests across `workers` processes"""
+    # One event loop per process: a single Python process saturates one
+    # core long before the server does
+    shares = [count // workers + (i < count % workers) for i in range(workers)]
+    shares = [n for n in shares if n > 0]
+    with ProcessPoolExecutor(max_workers=len(shares)) as ex:
+        outcomes = list(ex.map(load_worker, shares, [concurrency] * len(shares),
+                               [HOST] * len(shares), [PORT] * len(shares)))
+    # Workers run side by side, so the slowest one bounds the load run
+    failed = sum(f for f, _ in outcomes)
+    elapsed = max(e for _, e in outcomes)
+    return load_stats(count, failed, elapsed)
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="HTTP request parser test suite")
+    parser.add_argument('-y', '--yes', action='store_true',
+                        help="start immediately instead of waiting for Enter")
+    parser.add_argument('--host', default=HOST, help="server host")
+    parser.add_argument('--port', type=int, default=PORT, help="server port")
+    parser.add_argument('--repeat', type=positive_int, default=1,
+                        help="run the suite N times, e.g. for timing")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="print every request and response instead of a JSON report")
+    parser.add_argument('--load', type=non_negative_int, default=0,
+                        help="afterwards, send N requests as a load test")
+    parser.add_argument('--concurrency', type=positive_int, default=100,
+                        help="concurrent connections per worker for --load")
+    parser.add_argument('--workers', type=positive_int, default=os.cpu_count() or 1,
+                        help="worker processes for --load (default: CPU count)")
+    return parser.parse_args()
+
+def main():
+    global HOST, PORT, VERBOSE
+    args = parse_args()
+    HOST, PORT, VERBOSE = args.host, args.port, args.verbose
+    build_requests(HOST, PORT)
     
-    test_directory_listing()
-    time.sleep(0.5)
+    if VERBOSE:
+        # Block-buffer the chatty output rather than flushing every line
+        sys.stdout.reconfigure(line_buffering=False)
+        print("="*60)
+        print("HTTP Request Parser Test Suite")
+        print("="*60)
+        print(f"Target: {HOST}:{PORT}")
+        print("Make sure your webserver is running before executing tests!")
+        print()
+        
+        # Only wait for a keypress when run interactively
+        if not (args.yes or os.environ.get('CI')):
+            input("Press Enter to start tests...")
     
-    test_404_not_found()
-    time.sleep(0.5)
+    # Probe once up front instead of sleeping between tests
+    if not wait_ready(HOST, PORT):
+        print(f"Server at {HOST}:{PORT} is not accepting connections", file=sys.stderr)
+        sys.exit(1)
     
-    test_large_headers()
-    time.sleep(0.5)
+    # Run all tests concurrently on one event loop
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        asyncio.run(run_tests())
+    elapsed = time.perf_counter() - start
     
-    test_invalid_method()
-    time.sleep(0.5)
+    load = None
+    if args.load > 0:
+        load = run_load(args.load, args.concurrency, args.workers)
     
-    test_malformed_request()
+    if not VERBOSE:
+        write_report({
+            'suite': 'parser',
+            'target': f"{HOST}:{PORT}",
+            'runs': args.repeat,
+            'elapsed_ms': round(elapsed * 1000, 3),
+            'results': RESULTS,
+            'load': load,
+        })
+        return
     
     print("\n" + "="*60)
     print("All tests completed!")
+    print(f"{args.repeat} run(s) in {elapsed:.3f}s")
     print("="*60)
+    
+    if load is not None:
+        print(f"\nLoad test ({args.workers} worker(s) x {args.concurrency} concurrent):")
+        print(summarize_load(load))
 
 if __name__ == "__main__":
     main()
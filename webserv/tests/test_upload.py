@@ -3,174 +3,328 @@
 Test script for file upload functionality using curl-like multipart/form-data
 """
 
+import argparse
+import asyncio
 import socket
 import os
 import sys
+import time
+from functools import lru_cache
+
+from common_client import (count_failed, format_response, load_stats, make_result,
+                           non_negative_int, parse_content_length, positive_int,
+                           run_many, summarize_load, wait_ready, write_report)
 
 HOST = 'localhost'
 PORT = 8080
+VERBOSE = False
+CHUNK_SIZE = 65536
+BOUNDARY = '----WebKitFormBoundary7MA4YWxkTrZu0gW'
 
-def create_multipart_body(filename, content, boundary):
-    """Create a multipart/form-data body"""
-    body = []
-    body.append(f'--{boundary}')
-    body.append(f'Content-Disposition: form-data; name="file"; filename="{filename}"')
-    body.append('Content-Type: text/plain')
-    body.append('')
-    body.append(content)
-    body.append(f'--{boundary}--')
-    body.append('')
-    
-    return '\r\n'.join(body)
-
-def test_file_upload(filename, content):
-    """Test file upload"""
-    boundary = '----WebKitFormBoundary7MA4YWxkTrZu0gW'
-    body = create_multipart_body(filename, content, boundary)
-    
-    request = (
-        f"POST /upload HTTP/1.1\r\n"
-        f"Host: {HOST}:{PORT}\r\n"
-        f"Content-Type: multipart/form-data; boundary={boundary}\r\n"
-        f"Content-Length: {len(body)}\r\n"
-        f"Connection: close\r\n"
-        f"\r\n"
-        f"{body}"
-    )
+# One make_result() entry per upload sent, across every --repeat run
+RESULTS = []
+
+# Receive buffer reused by every recv_response() call; grows on demand
+RECV_BUFFER = bytearray(CHUNK_SIZE)
+
+# 10,000 numbered lines, built once rather than on every --repeat run
+LARGE_CONTENT = b"".join(f"Line {i}\n".encode() for i in range(10_000))
+
+# The two-file upload body, built once rather than on every --repeat run
+MULTIPLE_FILES_BODY = b'\r\n'.join([
+    # File 1
+    f'--{BOUNDARY}'.encode(),
+    b'Content-Disposition: form-data; name="file1"; filename="test1.txt"',
+    b'Content-Type: text/plain',
+    b'',
+    b'This is the first test file',
+    b'',
     
-    print(f"Uploading file: {filename}")
-    print(f"Content size: {len(content)} bytes")
-    print("-" * 60)
+    # File 2
+    f'--{BOUNDARY}'.encode(),
+    b'Content-Disposition: form-data; name="file2"; filename="test2.txt"',
+    b'Content-Type: text/plain',
+    b'',
+    b'This is the second test file',
+    b'',
     
+    # End boundary
+    f'--{BOUNDARY}--'.encode(),
+    b'',
+])
+
+# A real binary file from the site, sent from disk with sendfile
+IMAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'www', 'images', '03d5cbf9-6bcd-498d-af27-1c7dad58dadc.png')
+
+def open_upload_socket():
+    """Connect to the server with a socket tuned for uploads"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Disable Nagle so a small head write is not held back waiting for
+        # the delayed ACK of the previous segment
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # A 1 MB send buffer lets the kernel accept large bursts in one send()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
         sock.settimeout(10.0)
         sock.connect((HOST, PORT))
-        
-        sock.sendall(request.encode('utf-8'))
-        
-        response = b''
-        while True:
-            try:
-                chunk = sock.recv(4096)
-                if not chunk:
-                    break
-                response += chunk
-            except socket.timeout:
-                break
-        
+    except BaseException:
         sock.close()
-        
-        print("Server response:")
-        print(response.decode('utf-8', errors='replace'))
-        return True
-        
-    except Exception as e:
-        print(f"Error: {e}")
-        return False
+        raise
+    return sock
 
-def test_multiple_files():
-    """Test uploading multiple files"""
-    boundary = '----WebKitFormBoundary7MA4YWxkTrZu0gW'
-    
-    # Create multipart body with multiple files
-    body = []
-    
-    # File 1
-    body.append(f'--{boundary}')
-    body.append('Content-Disposition: form-data; name="file1"; filename="test1.txt"')
-    body.append('Content-Type: text/plain')
-    body.append('')
-    body.append('This is the first test file')
-    body.append('')
-    
-    # File 2
-    body.append(f'--{boundary}')
-    body.append('Content-Disposition: form-data; name="file2"; filename="test2.txt"')
-    body.append('Content-Type: text/plain')
-    body.append('')
-    body.append('This is the second test file')
-    body.append('')
-    
-    # End boundary
-    body.append(f'--{boundary}--')
-    body.append('')
-    
-    body_str = '\r\n'.join(body)
+def recv_response(sock):
+    """Receive one response, framed by its Content-Length header"""
+    # The server keeps connections open, so EOF cannot mark the end of the
+    # response; read the head, then exactly Content-Length bytes of body.
+    # recv_into() writes straight into the shared RECV_BUFFER, so the loop
+    # allocates nothing per chunk
+    buf = RECV_BUFFER
+    pos = 0
+    head_end = -1
+    total = None
+    while total is None or pos < total:
+        if pos == len(buf):
+            # Full: double it; the larger buffer is kept for later calls
+            buf.extend(bytes(len(buf)))
+        try:
+            n = sock.recv_into(memoryview(buf)[pos:])
+        except socket.timeout:
+            if head_end < 0:
+                raise
+            # No length announced: the socket timeout ends the response
+            break
+        if not n:
+            break
+        pos += n
+        
+        if head_end < 0:
+            # Only rescan the bytes just received (plus a possible split CRLF)
+            eoh = buf.find(b'\r\n\r\n', max(0, pos - n - 3), pos)
+            if eoh >= 0:
+                head_end = eoh + 4
+                length = parse_content_length(buf[:head_end])
+                if length is not None:
+                    total = head_end + length
     
-    request = (
+    return bytes(memoryview(buf)[:pos])
+
+@lru_cache(maxsize=32)
+def multipart_envelope(filename, boundary, content_type='text/plain'):
+    """Return the multipart bytes sent before and after a file payload"""
+    # Built as bytes from the start so binary payloads are never decoded
+    # or re-encoded on their way to the socket
+    head = b'\r\n'.join([
+        f'--{boundary}'.encode(),
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"'.encode(),
+        f'Content-Type: {content_type}'.encode(),
+        b'',
+        b'',
+    ])
+    tail = f'\r\n--{boundary}--\r\n'.encode()
+    return head, tail
+
+def payload_size(source):
+    """Size of an upload payload given as bytes or as a path on disk"""
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    return len(source)
+
+def iter_chunks(content, size=CHUNK_SIZE):
+    """Yield successive slices of an in-memory payload without copying it"""
+    view = memoryview(content)
+    for start in range(0, len(view), size):
+        yield view[start:start + size]
+
+@lru_cache(maxsize=64)
+def upload_header(host, port, content_length):
+    """Return the HTTP head of a multipart upload request"""
+    # Cached: repeated runs send the same few heads, so each one is
+    # formatted and encoded only once
+    return (
         f"POST /upload HTTP/1.1\r\n"
-        f"Host: {HOST}:{PORT}\r\n"
-        f"Content-Type: multipart/form-data; boundary={boundary}\r\n"
-        f"Content-Length: {len(body_str)}\r\n"
+        f"Host: {host}:{port}\r\n"
+        f"Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n"
+        f"Content-Length: {content_length}\r\n"
         f"Connection: close\r\n"
         f"\r\n"
-        f"{body_str}"
-    )
+    ).encode()
+
+def build_upload_request(host, port, filename, content):
+    """Return a complete single-file upload request held in memory"""
+    head, tail = multipart_envelope(filename, BOUNDARY)
+    return upload_header(host, port, len(head) + len(content) + len(tail)) + head + content + tail
+
+def stream_upload(sock, filename, source, content_type='text/plain'):
+    """Send a single-file upload request, streaming the payload"""
+    head, tail = multipart_envelope(filename, BOUNDARY, content_type)
+    header = upload_header(HOST, PORT, len(head) + payload_size(source) + len(tail))
     
-    print("Uploading multiple files...")
-    print("-" * 60)
+    sock.sendall(header + head)
+    if isinstance(source, str):
+        # File on disk: the kernel copies it straight to the socket (sendfile)
+        with open(source, 'rb') as f:
+            sock.sendfile(f)
+    else:
+        for chunk in iter_chunks(source):
+            sock.sendall(chunk)
+    sock.sendall(tail)
+
+def test_file_upload(filename, source, content_type='text/plain'):
+    """Test file upload (source is bytes or a path on disk)"""
+    if VERBOSE:
+        print(f"Uploading file: {filename}")
+        print(f"Content size: {payload_size(source)} bytes")
+        print("-" * 60)
     
+    response = b''
+    start = time.perf_counter()
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(10.0)
-        sock.connect((HOST, PORT))
-        
-        sock.sendall(request.encode('utf-8'))
-        
-        response = b''
-        while True:
-            try:
-                chunk = sock.recv(4096)
-                if not chunk:
-                    break
-                response += chunk
-            except socket.timeout:
-                break
-        
-        sock.close()
-        
-        print("Server response:")
-        print(response.decode('utf-8', errors='replace'))
-        return True
+        with open_upload_socket() as sock:
+            stream_upload(sock, filename, source, content_type)
+            response = recv_response(sock)
+        error = None
         
     except Exception as e:
-        print(f"Error: {e}")
-        return False
+        error = e
+    
+    return record(f"Upload {filename}", time.perf_counter() - start, response, error)
 
-def main():
-    print("="*60)
-    print("File Upload Test Suite")
-    print("="*60)
-    print(f"Target: {HOST}:{PORT}")
-    print("Make sure your webserver is running!")
-    print()
+def test_multiple_files():
+    """Test uploading multiple files"""
+    header = upload_header(HOST, PORT, len(MULTIPLE_FILES_BODY))
     
-    input("Press Enter to start tests...")
+    if VERBOSE:
+        print("Uploading multiple files...")
+        print("-" * 60)
     
+    response = b''
+    start = time.perf_counter()
+    try:
+        with open_upload_socket() as sock:
+            sock.sendall(header)
+            sock.sendall(MULTIPLE_FILES_BODY)
+            response = recv_response(sock)
+        error = None
+        
+    except Exception as e:
+        error = e
+    
+    return record("Upload multiple files", time.perf_counter() - start, response, error)
+
+def record(name, elapsed, response, error):
+    """Add a test outcome to RESULTS, printing it in verbose mode"""
+    RESULTS.append(make_result(name, elapsed, response, error))
+    if VERBOSE:
+        if error is not None:
+            print(f"Error: {error}")
+        else:
+            print("Server response:")
+            print(format_response(response))
+    return error is None
+
+def banner(title):
+    """Announce a test in verbose mode"""
+    if VERBOSE:
+        print("\n" + "="*60)
+        print(title)
+        print("="*60)
+
+def run_tests():
+    """Run every upload test once"""
     # Test 1: Simple text file
-    print("\n" + "="*60)
-    print("Test 1: Upload simple text file")
-    print("="*60)
-    test_file_upload("hello.txt", "Hello, World!\nThis is a test file.")
+    banner("Test 1: Upload simple text file")
+    test_file_upload("hello.txt", b"Hello, World!\nThis is a test file.")
     
     # Test 2: Larger file
-    print("\n" + "="*60)
-    print("Test 2: Upload larger file")
-    print("="*60)
-    large_content = "Line {}\n".format(1) * 100
-    test_file_upload("large.txt", large_content)
+    banner("Test 2: Upload larger file")
+    test_file_upload("large.txt", LARGE_CONTENT)
     
-    # Test 3: Multiple files
-    print("\n" + "="*60)
-    print("Test 3: Upload multiple files")
-    print("="*60)
+    # Test 3: File streamed from disk
+    banner("Test 3: Upload file from disk")
+    test_file_upload("image.png", IMAGE_PATH, 'image/png')
+    
+    # Test 4: Multiple files
+    banner("Test 4: Upload multiple files")
     test_multiple_files()
+
+def run_load(count, concurrency):
+    """Send `count` small in-memory uploads, `concurrency` at a time"""
+    request = build_upload_request(HOST, PORT, "load.txt", b"Load test upload\n")
+    start = time.perf_counter()
+    responses = asyncio.run(run_many(HOST, PORT, [request] * count, concurrency))
+    return load_stats(count, count_failed(responses), time.perf_counter() - start)
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="File upload test suite")
+    parser.add_argument('-y', '--yes', action='store_true',
+                        help="start immediately instead of waiting for Enter")
+    parser.add_argument('--host', default=HOST, help="server host")
+    parser.add_argument('--port', type=int, default=PORT, help="server port")
+    parser.add_argument('--repeat', type=positive_int, default=1,
+                        help="run the suite N times, e.g. for timing")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="print every upload and response instead of a JSON report")
+    parser.add_argument('--load', type=non_negative_int, default=0,
+                        help="afterwards, send N small uploads as a load test")
+    parser.add_argument('--concurrency', type=positive_int, default=100,
+                        help="concurrent connections for --load")
+    return parser.parse_args()
+
+def main():
+    global HOST, PORT, VERBOSE
+    args = parse_args()
+    HOST, PORT, VERBOSE = args.host, args.port, args.verbose
+    
+    if VERBOSE:
+        # Block-buffer the chatty output rather than flushing every line
+        sys.stdout.reconfigure(line_buffering=False)
+        print("="*60)
+        print("File Upload Test Suite")
+        print("="*60)
+        print(f"Target: {HOST}:{PORT}")
+        print("Make sure your webserver is running!")
+        print()
+        
+        # Only wait for a keypress when run interactively
+        if not (args.yes or os.environ.get('CI')):
+            input("Press Enter to start tests...")
+    
+    # Probe once up front instead of sleeping between tests
+    if not wait_ready(HOST, PORT):
+        print(f"Server at {HOST}:{PORT} is not accepting connections", file=sys.stderr)
+        sys.exit(1)
+    
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        run_tests()
+    elapsed = time.perf_counter() - start
+    
+    load = None
+    if args.load > 0:
+        load = run_load(args.load, args.concurrency)
+    
+    if not VERBOSE:
+        write_report({
+            'suite': 'upload',
+            'target': f"{HOST}:{PORT}",
+            'runs': args.repeat,
+            'elapsed_ms': round(elapsed * 1000, 3),
+            'results': RESULTS,
+            'load': load,
+        })
+        return
     
     print("\n" + "="*60)
     print("All upload tests completed!")
+    print(f"{args.repeat} run(s) in {elapsed:.3f}s")
     print("Check the ./uploads directory for uploaded files")
     print("="*60)
+    
+    if load is not None:
+        print(f"\nLoad test ({args.concurrency} concurrent):")
+        print(summarize_load(load))
 
 if __name__ == "__main__":
     main()